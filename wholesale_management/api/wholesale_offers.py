@@ -1,11 +1,15 @@
 # wholesale_management/wholesale_management/api/wholesale_offers.py
 
+import json
+
 import frappe
 from frappe import _
-from datetime import datetime, timedelta
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
 
 @frappe.whitelist()
-def get_wholesale_availability(months_lookback=3, months_par=6, buffer_percent=10, warehouse="Stores - SURGI"):
+def get_wholesale_availability(months_lookback=3, months_par=6, buffer_percent=10, warehouse="Stores - SURGI",
+        page_size=0, cursor=None):
     """
     Calculate wholesale availability for all items based on:
     - Current inventory in specified warehouse only
@@ -19,114 +23,242 @@ def get_wholesale_availability(months_lookback=3, months_par=6, buffer_percent=1
         months_par (int): Number of months of par to maintain (default: 6)
         buffer_percent (int): Additional buffer percentage (default: 10)
         warehouse (str): Warehouse to check inventory (default: 'Stores - SURGI')
+        page_size (int): Items per page; 0 returns all items (default: 0)
+        cursor (str): JSON [brand, item_name, item_code] of the last row of the
+            previous page, as returned in summary.next_cursor
     
     Returns:
         list: Wholesale offer data for all eligible items
     """
     
-    from wholesale_management.utils.calculations import (
-        calculate_par_level,
-        calculate_on_hold_qty,
-        calculate_wholesale_qty,
-        calculate_avg_sale_price,
-        get_last_purchase_price
+    from wholesale_management.utils.cache import (
+        get_cached_wholesale_availability,
+        get_wholesale_cache_key,
+        set_cached_wholesale_availability
     )
+    from wholesale_management.utils.calculations import get_on_hold_query
     
     # Validate parameters
     months_lookback = int(months_lookback)
     months_par = int(months_par)
     buffer_percent = float(buffer_percent)
+    page_size = max(int(page_size), 0)
+    
+    cursor = cursor or None
+    
+    if isinstance(cursor, str):
+        try:
+            cursor = json.loads(cursor)
+        except ValueError:
+            pass  # still a string, rejected below
+    
+    if cursor is not None and not (isinstance(cursor, list) and len(cursor) == 3):
+        frappe.throw(_('Invalid cursor, pass summary.next_cursor from the previous page'),
+            frappe.ValidationError)
+    
+    # Serve repeated calls from cache; cleared on submit/cancel of the
+    # source documents (see doc_events in hooks.py)
+    cache_key = get_wholesale_cache_key(
+        warehouse, months_lookback, months_par, buffer_percent, page_size, cursor
+    )
+    cached = get_cached_wholesale_availability(cache_key)
+    
+    if cached:
+        frappe.response['message'] = cached
+        return cached
     
     # Get date range for average calculation
-    lookback_date = (datetime.now() - timedelta(days=months_lookback * 30)).strftime('%Y-%m-%d')
+    now = datetime.now()
+    lookback_date = (now - relativedelta(months=months_lookback)).date()
+    months_div = max(months_lookback, 1)  # Prevent division by zero
     
-    # Main query - FILTER BY SPECIFIED WAREHOUSE ONLY
+    # Single query - the page of items stocked in the SPECIFIED WAREHOUSE ONLY
+    # is selected first, then every per-item metric is aggregated in a CTE
+    # restricted to that page; wholesale qty and rounding are computed in SQL
+    # so Python only serializes the rows
     query = """
+        WITH page AS (
+            -- Keyset page of stocked items, read in (brand, item_name) order
+            SELECT 
+                i.name as item_code,
+                i.item_name,
+                i.brand,
+                i.item_group,
+                i.custom_wholesale_offer_price,
+                b.actual_qty as qty_available
+            FROM `tabItem` i
+            INNER JOIN `tabBin` b ON b.item_code = i.name AND b.warehouse = %(warehouse)s
+            WHERE i.disabled = 0
+            AND i.is_stock_item = 1
+            AND b.actual_qty > 0
+            {cursor_condition}
+            ORDER BY i.brand, i.item_name, i.name
+            {limit}
+        ),
+        par AS (
+            -- Average monthly sales over lookback period
+            SELECT sii.item_code, SUM(sii.qty) / %(months_div)s as par_level
+            FROM `tabSales Invoice Item` sii
+            JOIN `tabSales Invoice` si ON sii.parent = si.name
+            WHERE sii.item_code IN (SELECT item_code FROM page)
+            AND si.docstatus = 1
+            AND si.posting_date >= %(lookback_date)s
+            AND si.is_return = 0
+            GROUP BY sii.item_code
+        ),
+        on_hold AS (
+            -- Outstanding Sales Order quantity + open Quotations
+            SELECT item_code, SUM(qty) as on_hold
+            FROM ({on_hold_query}) held
+            GROUP BY item_code
+        ),
+        avg_price AS (
+            -- Average sale price per unit (before taxes) from warehouse
+            SELECT sii.item_code, SUM(sii.base_amount) / SUM(sii.qty) as avg_sale_price
+            FROM `tabSales Invoice Item` sii
+            JOIN `tabSales Invoice` si ON sii.parent = si.name
+            WHERE sii.item_code IN (SELECT item_code FROM page)
+            AND si.docstatus = 1
+            AND si.posting_date >= %(lookback_date)s
+            AND si.is_return = 0
+            AND sii.qty > 0
+            AND sii.warehouse = %(warehouse)s
+            GROUP BY sii.item_code
+        ),
+        last_cost AS (
+            -- Last purchase price per unit into warehouse
+            SELECT item_code, unit_cost
+            FROM (
+                SELECT 
+                    item_code,
+                    rate as unit_cost,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY item_code
+                        ORDER BY creation DESC
+                    ) as rn
+                FROM `tabPurchase Receipt Item`
+                WHERE item_code IN (SELECT item_code FROM page)
+                AND docstatus = 1
+                AND warehouse = %(warehouse)s
+            ) last_pr
+            WHERE rn = 1
+        )
         SELECT 
-            i.name as item_code,
-            i.item_name,
-            i.brand,
-            i.item_group,
-            i.custom_wholesale_offer_price as last_offer_price,
-            COALESCE(SUM(bin.actual_qty), 0) as qty_available
-        FROM `tabItem` i
-        INNER JOIN `tabBin` bin ON bin.item_code = i.name
-        WHERE i.disabled = 0
-        AND i.is_stock_item = 1
-        AND bin.warehouse = %s
-        GROUP BY i.name
-        HAVING qty_available > 0
-        ORDER BY i.brand, i.item_name
+            page.item_code,
+            page.item_name,
+            page.brand,
+            COALESCE(page.item_group, '') as item_group,
+            page.custom_wholesale_offer_price as last_offer_price,
+            page.qty_available,
+            COALESCE(on_hold.on_hold, 0) as on_hold,
+            ROUND(COALESCE(par.par_level, 0), 2) as par_level,
+            ROUND(COALESCE(avg_price.avg_sale_price, 0), 2) as avg_sale_price,
+            ROUND(COALESCE(last_cost.unit_cost, 0), 2) as cost,
+            ROUND(GREATEST(0,
+                page.qty_available - COALESCE(on_hold.on_hold, 0)
+                - COALESCE(par.par_level, 0) * %(months_par)s * (1 + %(buffer_percent)s / 100)
+            ), 0) as wholesale_qty
+        FROM page
+        LEFT JOIN on_hold ON on_hold.item_code = page.item_code
+        LEFT JOIN par ON par.item_code = page.item_code
+        LEFT JOIN avg_price ON avg_price.item_code = page.item_code
+        LEFT JOIN last_cost ON last_cost.item_code = page.item_code
+        ORDER BY page.brand, page.item_name, page.item_code
     """
     
-    items = frappe.db.sql(query, (warehouse,), as_dict=True)
+    params = {
+        'warehouse': warehouse,
+        'lookback_date': lookback_date,
+        'months_div': months_div,
+        'months_par': months_par,
+        'buffer_percent': buffer_percent
+    }
     
-    results = []
+    # Keyset pagination - the page CTE resumes after the last row of the
+    # previous page instead of sorting and skipping the full set, and the
+    # metric CTEs only aggregate the items on the page
+    cursor_condition = ""
     
-    for item in items:
-        # Calculate par level (average monthly sales over 3 months)
-        par_level = calculate_par_level(
-            item_code=item.item_code,
-            lookback_date=lookback_date
-        )
+    if cursor:
+        params['last_brand'], params['last_item_name'], params['last_item_code'] = cursor
         
-        # Calculate on hold quantity
-        on_hold = calculate_on_hold_qty(item_code=item.item_code)
-        
-        # Calculate wholesale available quantity
-        wholesale_qty = calculate_wholesale_qty(
-            qty_available=item.qty_available,
-            on_hold=on_hold,
-            par_level=par_level,
-            months_par=months_par,
-            buffer_percent=buffer_percent
-        )
-        
-        # Calculate average sale price over last 3 months FROM SPECIFIED WAREHOUSE
-        avg_sale_price = calculate_avg_sale_price(
-            item_code=item.item_code,
-            lookback_date=lookback_date,
-            warehouse=warehouse
-        )
-        
-        # Get last purchase price FROM SPECIFIED WAREHOUSE
-        cost = get_last_purchase_price(
-            item_code=item.item_code,
-            warehouse=warehouse
-        )
+        if params['last_brand'] is None:
+            # Items without a brand sort first; finish those, then all branded items
+            cursor_condition = """
+                AND (i.brand IS NOT NULL
+                    OR (i.brand IS NULL
+                        AND (i.item_name, i.name) > (%(last_item_name)s, %(last_item_code)s)))
+            """
+        else:
+            cursor_condition = """
+                AND (i.brand, i.item_name, i.name) > (%(last_brand)s, %(last_item_name)s, %(last_item_code)s)
+            """
+    
+    # Bound the response (and memory) to one page when requested
+    limit = ""
+    
+    if page_size:
+        limit = "LIMIT %(limit)s"
+        params['limit'] = page_size
+    
+    query = query.format(
+        on_hold_query=get_on_hold_query("IN (SELECT item_code FROM page)"),
+        cursor_condition=cursor_condition,
+        limit=limit
+    )
+    
+    results = []
+    _append = results.append
+    
+    # Stream rows from an unbuffered cursor so the raw result set is never
+    # held in memory alongside the response
+    with frappe.db.unbuffered_cursor():
+        items = frappe.db.sql(query, params, as_list=True, as_iterator=True)
         
-        # Include ALL items with inventory, even if wholesale_qty is 0 or negative
-        results.append({
-            'brand': item.brand or '',
-            'item_code': item.item_code,
-            'item_name': item.item_name,
-            'item_group': item.item_group or '',
-            'wholesale_qty': round(wholesale_qty, 0),  # Can be 0 or negative
-            'last_offer_price': item.last_offer_price or 'MO',
-            'qty_available': item.qty_available,
-            'on_hold': on_hold,
-            'par_level': round(par_level, 2),  # 3 month average
-            'avg_sale_price': round(avg_sale_price, 2),
-            'lowest_offer': None,  # Placeholder for future calculation
-            'cost': round(cost, 2),
-            'par_months': months_par,
-            'buffer_percent': buffer_percent
-        })
+        # Plain rows unpacked positionally (column order of the SELECT above)
+        for (item_code, item_name, brand, item_group, last_offer_price, qty_available,
+                on_hold, par_level, avg_sale_price, cost, wholesale_qty) in items:
+            # Include ALL items with inventory, even if wholesale_qty is 0
+            _append({
+                'brand': brand or '',  # raw brand is kept for next_cursor
+                'item_code': item_code,
+                'item_name': item_name,
+                'item_group': item_group,
+                'wholesale_qty': wholesale_qty,
+                'last_offer_price': last_offer_price or 'MO',
+                'qty_available': qty_available,
+                'on_hold': on_hold,
+                'par_level': par_level,  # monthly average
+                'avg_sale_price': avg_sale_price,
+                'lowest_offer': None,  # Placeholder for future calculation
+                'cost': cost
+            })
+    
+    # A full page means there may be more; the loop variables hold the raw
+    # sort key of the last row
+    next_cursor = None
+    if page_size and len(results) == page_size:
+        next_cursor = [brand, item_name, item_code]
     
     frappe.response['message'] = {
         'data': results,
         'summary': {
             'total_items': len(results),
             'warehouse': warehouse,
-            'generated_at': datetime.now().isoformat(),
+            'generated_at': now.isoformat(),
             'parameters': {
                 'months_lookback': months_lookback,
                 'months_par': months_par,
-                'buffer_percent': buffer_percent
-            }
+                'buffer_percent': buffer_percent,
+                'page_size': page_size,
+                'cursor': cursor
+            },
+            'next_cursor': json.dumps(next_cursor) if next_cursor else None
         }
     }
     
+    set_cached_wholesale_availability(cache_key, frappe.response['message'])
+    
     return frappe.response['message']
 
 
@@ -141,33 +273,68 @@ def update_offer_prices(items_data):
     Returns:
         dict: Success status and count
     """
-    import json
+    
+    from wholesale_management.utils.cache import clear_wholesale_cache
     
     if isinstance(items_data, str):
         items_data = json.loads(items_data)
     
-    updated_count = 0
     errors = []
     
+    # Collect all updates first and write them in one batched UPDATE
+    # (CASE name WHEN ...) instead of a set_value round-trip per item
+    doc_updates = {}
+    
     for item in items_data:
-        try:
-            item_code = item.get('item_code')
-            offer_price = item.get('offer_price')
-            
-            if not item_code:
+        item_code = item.get('item_code')
+        offer_price = item.get('offer_price')
+        
+        if not item_code:
+            continue
+        
+        # Reject non-numeric prices (e.g. the sheet's 'MO' placeholder) per
+        # item so they cannot fail the whole batch; blank clears the price
+        if offer_price in (None, ''):
+            offer_price = None
+        else:
+            try:
+                offer_price = float(offer_price)
+            except (TypeError, ValueError):
+                errors.append({
+                    'item_code': item_code,
+                    'error': _('Invalid offer price: {0}').format(offer_price)
+                })
                 continue
+        
+        doc_updates[item_code] = {'custom_wholesale_offer_price': offer_price}
+    
+    try:
+        if doc_updates:
+            frappe.db.bulk_update('Item', doc_updates)
+        updated_count = len(doc_updates)
+        
+    except Exception:
+        # Fall back to per-item updates so one bad row only fails that item
+        frappe.db.rollback()
+        updated_count = 0
+        
+        for item_code, values in doc_updates.items():
+            try:
+                frappe.db.set_value('Item', item_code, values)
+                updated_count += 1
                 
-            frappe.db.set_value('Item', item_code, 'custom_wholesale_offer_price', offer_price)
-            updated_count += 1
-            
-        except Exception as e:
-            errors.append({
-                'item_code': item_code,
-                'error': str(e)
-            })
+            except Exception as e:
+                errors.append({
+                    'item_code': item_code,
+                    'error': str(e)
+                })
     
     frappe.db.commit()
     
+    # Cached availability responses carry last_offer_price
+    if updated_count:
+        clear_wholesale_cache()
+    
     return {
         'success': True,
         'updated_count': updated_count,
@@ -185,14 +352,12 @@ def get_available_warehouses():
         list: Active warehouse names
     """
     
-    query = """
-        SELECT name, warehouse_name
-        FROM `tabWarehouse`
-        WHERE disabled = 0
-        ORDER BY name
-    """
-    
-    warehouses = frappe.db.sql(query, as_dict=True)
+    warehouses = frappe.get_all(
+        'Warehouse',
+        filters={'disabled': 0},
+        fields=['name', 'warehouse_name'],
+        order_by='name'
+    )
     
     return {
         'warehouses': warehouses,
@@ -215,39 +380,36 @@ def get_item_wholesale_detail(item_code, warehouse="Stores - SURGI"):
     """
     
     from wholesale_management.utils.calculations import (
-        calculate_par_level,
-        calculate_on_hold_qty,
         get_item_sales_history,
-        calculate_avg_sale_price,
-        get_last_purchase_price
+        get_item_wholesale_metrics
     )
     
     # Get item info
-    item = frappe.get_doc('Item', item_code)
-    
-    # Get inventory in specified warehouse
-    bin_data = frappe.db.get_value(
-        'Bin',
-        {'item_code': item_code, 'warehouse': warehouse},
-        ['actual_qty', 'reserved_qty', 'ordered_qty', 'planned_qty'],
+    item = frappe.db.get_value(
+        'Item',
+        item_code,
+        ['item_name', 'brand', 'custom_wholesale_offer_price'],
         as_dict=True
     )
     
-    qty_available = bin_data.actual_qty if bin_data else 0
-    
-    # Calculate metrics
-    lookback_date = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-    par_level = calculate_par_level(item_code, lookback_date)
-    on_hold = calculate_on_hold_qty(item_code)
-    sales_history = get_item_sales_history(item_code, months=12)
-    avg_sale_price = calculate_avg_sale_price(item_code, lookback_date, warehouse)
-    cost = get_last_purchase_price(item_code, warehouse)
+    if not item:
+        frappe.throw(_('Item {0} not found').format(item_code), frappe.DoesNotExistError)
     
-    # Calculate wholesale qty
+    # Calculate stock, metrics and wholesale qty in one query
+    months_lookback = 3
     months_par = 6
     buffer_percent = 10
-    par_with_buffer = (par_level * months_par) * (1 + buffer_percent / 100)
-    wholesale_qty = max(0, qty_available - on_hold - par_with_buffer)
+    lookback_date = (datetime.now() - relativedelta(months=months_lookback)).date()
+    metrics = get_item_wholesale_metrics(
+        item_code,
+        lookback_date,
+        warehouse,
+        months_div=months_lookback,
+        months_par=months_par,
+        buffer_percent=buffer_percent
+    )
+    par_level = metrics['par_level']
+    sales_history = get_item_sales_history(item_code, months=12)
     
     return {
         'item_code': item_code,
@@ -255,20 +417,20 @@ def get_item_wholesale_detail(item_code, warehouse="Stores - SURGI"):
         'brand': item.brand,
         'warehouse': warehouse,
         'inventory': {
-            'actual_qty': qty_available,
-            'reserved_qty': bin_data.reserved_qty if bin_data else 0,
-            'ordered_qty': bin_data.ordered_qty if bin_data else 0,
+            'actual_qty': metrics['qty_available'],
+            'reserved_qty': metrics['reserved_qty'],
+            'ordered_qty': metrics['ordered_qty'],
         },
         'calculations': {
             'par_level_monthly': round(par_level, 2),
             'par_months': months_par,
             'par_total': round(par_level * months_par, 2),
             'buffer_percent': buffer_percent,
-            'par_with_buffer': round(par_with_buffer, 2),
-            'on_hold': on_hold,
-            'wholesale_available': round(wholesale_qty, 0),
-            'avg_sale_price': round(avg_sale_price, 2),
-            'cost': round(cost, 2)
+            'par_with_buffer': round(metrics['par_with_buffer'], 2),
+            'on_hold': metrics['on_hold'],
+            'wholesale_available': round(metrics['wholesale_qty'], 0),
+            'avg_sale_price': round(metrics['avg_sale_price'], 2),
+            'cost': round(metrics['cost'], 2)
         },
         'sales_history': sales_history,
         'last_offer_price': item.custom_wholesale_offer_price
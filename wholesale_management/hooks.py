@@ -11,9 +11,34 @@ app_license = "MIT"
 
 # ... existing app info ...
 
+# Installation
+# Patches are marked completed on install without running, so apply the
+# schema patches the queries depend on here
+after_install = "wholesale_management.install.after_install"
+
 # Whitelisted API endpoints
 # Add this section if it doesn't exist
 doc_events = {
+    "Sales Invoice": {
+        "on_submit": "wholesale_management.utils.cache.clear_wholesale_cache",
+        "on_cancel": "wholesale_management.utils.cache.clear_wholesale_cache"
+    },
+    "Sales Order": {
+        "on_submit": "wholesale_management.utils.cache.clear_wholesale_cache",
+        "on_cancel": "wholesale_management.utils.cache.clear_wholesale_cache"
+    },
+    "Quotation": {
+        "on_submit": "wholesale_management.utils.cache.clear_wholesale_cache",
+        "on_cancel": "wholesale_management.utils.cache.clear_wholesale_cache"
+    },
+    "Delivery Note": {
+        "on_submit": "wholesale_management.utils.cache.clear_wholesale_cache",
+        "on_cancel": "wholesale_management.utils.cache.clear_wholesale_cache"
+    },
+    "Purchase Receipt": {
+        "on_submit": "wholesale_management.utils.cache.clear_wholesale_cache",
+        "on_cancel": "wholesale_management.utils.cache.clear_wholesale_cache"
+    }
 }
 
 # Scheduled Tasks (for future automation)
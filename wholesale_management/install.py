@@ -0,0 +1,18 @@
+# wholesale_management/wholesale_management/install.py
+
+from wholesale_management.patches import (
+    add_sales_invoice_posting_month,
+    add_sales_order_item_outstanding_qty
+)
+
+
+def after_install():
+    """
+    Create the generated columns the wholesale queries read
+    
+    install_app marks every patch in patches.txt as completed without
+    running it, so schema patches have to be applied here for new sites.
+    """
+    
+    add_sales_invoice_posting_month.execute()
+    add_sales_order_item_outstanding_qty.execute()
@@ -0,0 +1,12 @@
+# wholesale_management/wholesale_management/patches/add_item_listing_index.py
+
+import frappe
+
+
+def execute():
+    """
+    Index Item on the wholesale listing sort key so keyset pages of
+    get_wholesale_availability are read in index order without a filesort
+    """
+    
+    frappe.db.add_index("Item", ["brand", "item_name"])
@@ -0,0 +1,12 @@
+# wholesale_management/wholesale_management/patches/add_purchase_receipt_item_creation_index.py
+
+import frappe
+
+
+def execute():
+    """
+    Index Purchase Receipt Item for the last purchase price lookup, which
+    filters item_code/docstatus and takes the newest row by creation
+    """
+    
+    frappe.db.add_index("Purchase Receipt Item", ["item_code", "docstatus", "creation"])
@@ -0,0 +1,28 @@
+# wholesale_management/wholesale_management/patches/add_sales_invoice_posting_month.py
+
+import frappe
+
+
+def execute():
+    """
+    Add a stored posting_month (YYYYMM) generated column to Sales Invoice
+    
+    Lets get_item_sales_history group on an indexed column instead of
+    formatting posting_date for every row. EXTRACT(YEAR_MONTH) is used as
+    DATE_FORMAT depends on lc_time_names and is rejected in generated
+    columns. Frappe schema sync only alters columns defined on the doctype,
+    so the column survives migrations, but `bench trim-tables` drops it as a
+    column without a docfield; rerun this patch if the tables are trimmed.
+    
+    Also run from after_install (see wholesale_management.install), as new
+    sites mark patches completed without executing them.
+    """
+    
+    if frappe.db.has_column("Sales Invoice", "posting_month"):
+        return
+    
+    frappe.db.sql_ddl("""
+        ALTER TABLE `tabSales Invoice`
+        ADD COLUMN posting_month INT AS (EXTRACT(YEAR_MONTH FROM posting_date)) STORED,
+        ADD INDEX posting_month_index (posting_month, docstatus, is_return)
+    """)
@@ -0,0 +1,30 @@
+# wholesale_management/wholesale_management/patches/add_wholesale_covering_indexes.py
+
+import frappe
+
+
+def execute():
+    """
+    Add covering indexes for the wholesale aggregate queries
+    
+    Child table indexes carry every column the SUM lookups read so they are
+    answered from the index; parent indexes cover the docstatus / status /
+    posting_date filters applied after the parent join.
+    """
+    
+    # Parent filters
+    frappe.db.add_index("Sales Invoice", ["docstatus", "is_return", "posting_date"])
+    frappe.db.add_index("Sales Order", ["docstatus", "status"])
+    frappe.db.add_index("Quotation", ["docstatus", "status"])
+    
+    # Child tables - item_code + parent join + aggregated columns
+    frappe.db.add_index(
+        "Sales Invoice Item",
+        ["item_code", "parent", "qty", "base_amount", "warehouse"],
+        "idx_sii_item_covering"
+    )
+    frappe.db.add_index(
+        "Quotation Item",
+        ["item_code", "parent", "qty"],
+        "idx_qi_item_covering"
+    )
@@ -0,0 +1,15 @@
+# wholesale_management/wholesale_management/patches/add_wholesale_indexes.py
+
+import frappe
+
+
+def execute():
+    """
+    Add a composite index on Bin for the wholesale availability stock lookup
+    
+    Bin already has a unique (item_code, warehouse) key; the availability
+    query filters on warehouse first, so index it in that order. Child and
+    parent table indexes are added in add_wholesale_covering_indexes.
+    """
+    
+    frappe.db.add_index("Bin", ["warehouse", "item_code"])
@@ -0,0 +1,117 @@
+# wholesale_management/wholesale_management/utils/cache.py
+
+import functools
+import time
+
+import frappe
+
+# Redis hash holding cached get_wholesale_availability responses, one field
+# per parameter set, so clearing is a single DEL rather than a KEYS scan
+WHOLESALE_CACHE_KEY = "wholesale_availability"
+
+# On-hold quantities move with every order, keep cached results short lived
+WHOLESALE_CACHE_TTL = 120
+
+# Redis hash holding cached per-item calculations (see
+# wholesale_calculation_cache), cleared together with the availability hash
+WHOLESALE_CALCULATION_CACHE_KEY = "wholesale_calculations"
+CALCULATION_CACHE_TTL = 3600
+
+
+def get_wholesale_cache_key(*args):
+    """
+    Build the hash field for a set of wholesale availability parameters
+    
+    Returns:
+        str: Field name within WHOLESALE_CACHE_KEY
+    """
+    
+    return ":".join(str(arg) for arg in args)
+
+
+def get_cached_wholesale_availability(cache_key):
+    """
+    Get a cached availability response
+    
+    Args:
+        cache_key (str): Field from get_wholesale_cache_key
+    
+    Returns:
+        dict: Cached response, or None if missing or older than WHOLESALE_CACHE_TTL
+    """
+    
+    cached = frappe.cache().hget(WHOLESALE_CACHE_KEY, cache_key)
+    
+    if not cached:
+        return None
+    
+    # The hash expires as a whole, so each field carries its own write time
+    cached_at, response = cached
+    
+    if time.time() - cached_at > WHOLESALE_CACHE_TTL:
+        frappe.cache().hdel(WHOLESALE_CACHE_KEY, cache_key)
+        return None
+    
+    return response
+
+
+def set_cached_wholesale_availability(cache_key, response):
+    """
+    Cache an availability response for WHOLESALE_CACHE_TTL seconds
+    
+    Args:
+        cache_key (str): Field from get_wholesale_cache_key
+        response (dict): Response to cache
+    """
+    
+    frappe.cache().hset(WHOLESALE_CACHE_KEY, cache_key, (time.time(), response))
+    set_hash_expiry(WHOLESALE_CACHE_KEY, WHOLESALE_CACHE_TTL)
+
+
+def set_hash_expiry(name, ttl):
+    """
+    Expire a cache hash ttl seconds after it was created
+    Later writes do not extend it, so a polled hash still expires
+    
+    Args:
+        name (str): Cache hash name
+        ttl (int): Seconds to keep the hash
+    """
+    
+    cache = frappe.cache()
+    key = cache.make_key(name)
+    
+    # -1: hash exists without an expiry, i.e. it was just created
+    if cache.ttl(key) == -1:
+        cache.expire(key, ttl)
+
+
+def wholesale_calculation_cache(func):
+    """
+    Cache a per-item calculation in the WHOLESALE_CALCULATION_CACHE_KEY hash,
+    one field per function and arguments
+    hget also memoizes the value for the rest of the request
+    """
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache_key = get_wholesale_cache_key(func.__name__, *args, *sorted(kwargs.items()))
+        value = frappe.cache().hget(WHOLESALE_CALCULATION_CACHE_KEY, cache_key)
+        
+        if value is None:
+            value = func(*args, **kwargs)
+            frappe.cache().hset(WHOLESALE_CALCULATION_CACHE_KEY, cache_key, value)
+            set_hash_expiry(WHOLESALE_CALCULATION_CACHE_KEY, CALCULATION_CACHE_TTL)
+        
+        return value
+    
+    return wrapper
+
+
+def clear_wholesale_cache(doc=None, method=None):
+    """
+    Drop all cached wholesale availability results and per-item calculations
+    Hooked to submit/cancel of the documents feeding the calculation
+    """
+    
+    frappe.cache().delete_value([WHOLESALE_CACHE_KEY, WHOLESALE_CALCULATION_CACHE_KEY])
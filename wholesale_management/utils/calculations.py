@@ -1,42 +1,122 @@
 # wholesale_management/wholesale_management/utils/calculations.py
 
 import frappe
+from frappe.query_builder.functions import Coalesce, CurDate, Sum
+from pypika import CustomFunction
+from pypika.functions import Extract
+from pypika.terms import ValueWrapper
 
-def calculate_par_level(item_code, lookback_date):
+from wholesale_management.utils.cache import wholesale_calculation_cache
+
+# Calendar months in the lookback period, evaluated by the database
+# (minimum 1) - PERIOD_DIFF of YYYYMM values, not completed months
+PeriodDiff = CustomFunction("PERIOD_DIFF", ["p1", "p2"])
+Greatest = CustomFunction("GREATEST", ["a", "b"])
+
+# Open documents whose items count as on hold
+SALES_ORDER_HOLD_STATUSES = ("To Deliver and Bill", "To Deliver", "To Bill", "On Hold")
+QUOTATION_HOLD_STATUSES = ("Open", "Replied", "Partially Ordered", "Expired")
+
+
+@wholesale_calculation_cache
+def calculate_par_level(item_code, lookback_date, months_div=None):
     """
     Calculate average monthly sales for an item
     
     Args:
         item_code (str): Item code
-        lookback_date (str): Start date for calculation (YYYY-MM-DD)
+        lookback_date (date|str): Start date for calculation (YYYY-MM-DD)
+        months_div (int): Optional precomputed number of months in the
+            lookback period; callers looping over many items should pass it
     
     Returns:
         float: Average quantity sold per month
     """
     
-    # Calculate number of months in lookback period
-    from datetime import datetime
-    today = datetime.now()
-    lookback = datetime.strptime(lookback_date, '%Y-%m-%d')
-    months = (today.year - lookback.year) * 12 + (today.month - lookback.month)
+    par_levels = calculate_par_levels_bulk([item_code], lookback_date, months_div)
+    
+    return par_levels.get(item_code, 0)
+
+
+def calculate_par_levels_bulk(item_codes, lookback_date, months_div=None):
+    """
+    Calculate average monthly sales for many items in a single query
     
-    if months == 0:
-        months = 1  # Prevent division by zero
+    Args:
+        item_codes (list): Item codes
+        lookback_date (date|str): Start date for calculation (YYYY-MM-DD)
+        months_div (int): Optional precomputed number of months in the
+            lookback period
     
-    query = """
-        SELECT COALESCE(SUM(sii.qty), 0) as total_qty
-        FROM `tabSales Invoice Item` sii
-        JOIN `tabSales Invoice` si ON sii.parent = si.name
-        WHERE sii.item_code = %s
-        AND si.docstatus = 1
-        AND si.posting_date >= %s
-        AND si.is_return = 0
+    Returns:
+        dict: {item_code: average quantity sold per month}, 0 for items
+            without sales
+    """
+    
+    if not item_codes:
+        return {}
+    
+    if not months_div:
+        months_div = Greatest(
+            PeriodDiff(Extract("YEAR_MONTH", CurDate()), Extract("YEAR_MONTH", ValueWrapper(lookback_date))), 1
+        )
+    
+    sii = frappe.qb.DocType("Sales Invoice Item")
+    si = frappe.qb.DocType("Sales Invoice")
+    
+    result = (
+        frappe.qb.from_(sii)
+        .join(si).on(sii.parent == si.name)
+        .select(sii.item_code, (Coalesce(Sum(sii.qty), 0) / months_div).as_("par_level"))
+        .where(sii.item_code.isin(item_codes))
+        .where(si.docstatus == 1)
+        .where(si.posting_date >= lookback_date)
+        .where(si.is_return == 0)
+        .groupby(sii.item_code)
+    ).run()
+    
+    par_levels = dict.fromkeys(item_codes, 0)
+    par_levels.update(result)
+    
+    return par_levels
+
+
+def get_on_hold_query(item_condition=""):
+    """
+    Build the query for quantities on hold, one row per document line:
+    outstanding Sales Order quantity + open Quotations
+    
+    Args:
+        item_condition (str): Optional SQL condition on item_code applied to
+            both item tables, e.g. "= %(item_code)s"
+    
+    Returns:
+        str: Query selecting item_code, qty
     """
     
-    result = frappe.db.sql(query, (item_code, lookback_date), as_dict=True)
-    total_qty = result[0].total_qty if result else 0
+    so_statuses = ", ".join(frappe.db.escape(status) for status in SALES_ORDER_HOLD_STATUSES)
+    quotation_statuses = ", ".join(frappe.db.escape(status) for status in QUOTATION_HOLD_STATUSES)
+    so_item_condition = f"AND soi.item_code {item_condition}" if item_condition else ""
+    qi_item_condition = f"AND qi.item_code {item_condition}" if item_condition else ""
     
-    return total_qty / months
+    return f"""
+        SELECT soi.item_code, soi.outstanding_qty as qty
+        FROM `tabSales Order Item` soi
+        JOIN `tabSales Order` so ON soi.parent = so.name
+        WHERE so.docstatus = 1
+        AND so.status IN ({so_statuses})
+        AND soi.outstanding_qty > 0
+        {so_item_condition}
+        
+        UNION ALL
+        
+        SELECT qi.item_code, qi.qty
+        FROM `tabQuotation Item` qi
+        JOIN `tabQuotation` q ON qi.parent = q.name
+        WHERE q.docstatus = 1
+        AND q.status IN ({quotation_statuses})
+        {qi_item_condition}
+    """
 
 
 def calculate_on_hold_qty(item_code):
@@ -50,34 +130,162 @@ def calculate_on_hold_qty(item_code):
         float: Total quantity on hold
     """
     
-    # Sales Orders - outstanding quantity
-    so_query = """
-        SELECT COALESCE(SUM(soi.qty - soi.delivered_qty), 0) as on_hold_so
-        FROM `tabSales Order Item` soi
-        JOIN `tabSales Order` so ON soi.parent = so.name
-        WHERE soi.item_code = %s
-        AND so.docstatus = 1
-        AND so.status NOT IN ('Closed', 'Completed', 'Cancelled')
-        AND (soi.qty - soi.delivered_qty) > 0
+    # Sales Orders (outstanding quantity) + open Quotations in one round-trip
+    query = f"""
+        SELECT COALESCE(SUM(qty), 0) as on_hold
+        FROM ({get_on_hold_query("= %(item_code)s")}) held
     """
     
-    so_result = frappe.db.sql(so_query, (item_code,), as_dict=True)
-    on_hold_so = so_result[0].on_hold_so if so_result else 0
+    result = frappe.db.sql(query, {'item_code': item_code}, as_dict=True)
     
-    # Quotations - open quotations
-    quot_query = """
-        SELECT COALESCE(SUM(qi.qty), 0) as on_hold_quot
-        FROM `tabQuotation Item` qi
-        JOIN `tabQuotation` q ON qi.parent = q.name
-        WHERE qi.item_code = %s
-        AND q.docstatus = 1
-        AND q.status NOT IN ('Lost', 'Cancelled', 'Ordered')
+    return result[0].on_hold if result else 0
+
+
+def get_item_wholesale_metrics(item_code, lookback_date, warehouse=None, months_div=None,
+        months_par=6, buffer_percent=10):
     """
+    Get par level, on hold qty, average sale price, last purchase price,
+    stock and wholesale qty for one item in a single query
     
-    quot_result = frappe.db.sql(quot_query, (item_code,), as_dict=True)
-    on_hold_quot = quot_result[0].on_hold_quot if quot_result else 0
+    Same rules as calculate_par_level, calculate_on_hold_qty,
+    calculate_avg_sale_price, get_last_purchase_price and
+    calculate_wholesale_qty
     
-    return on_hold_so + on_hold_quot
+    Args:
+        item_code (str): Item code
+        lookback_date (date|str): Start date for sales metrics (YYYY-MM-DD)
+        warehouse (str): Optional warehouse filter for stock, sale price and cost
+        months_div (int): Optional precomputed number of months in the
+            lookback period
+        months_par (int): Number of months of par to maintain
+        buffer_percent (float): Additional buffer percentage
+    
+    Returns:
+        dict: par_level, par_with_buffer, on_hold, avg_sale_price, cost,
+            qty_available, reserved_qty, ordered_qty, wholesale_qty
+    """
+    
+    query = f"""
+        WITH par AS (
+            SELECT COALESCE(SUM(sii.qty), 0) as total_qty
+            FROM `tabSales Invoice Item` sii
+            JOIN `tabSales Invoice` si ON sii.parent = si.name
+            WHERE sii.item_code = %(item_code)s
+            AND si.docstatus = 1
+            AND si.posting_date >= %(lookback_date)s
+            AND si.is_return = 0
+        ),
+        on_hold AS (
+            SELECT COALESCE(SUM(qty), 0) as on_hold
+            FROM ({get_on_hold_query("= %(item_code)s")}) held
+        ),
+        avg_price AS (
+            SELECT 
+                COALESCE(SUM(sii.base_amount), 0) as total_amount,
+                COALESCE(SUM(sii.qty), 0) as total_qty
+            FROM `tabSales Invoice Item` sii
+            JOIN `tabSales Invoice` si ON sii.parent = si.name
+            WHERE sii.item_code = %(item_code)s
+            AND si.docstatus = 1
+            AND si.posting_date >= %(lookback_date)s
+            AND si.is_return = 0
+            AND sii.qty > 0
+            AND (%(warehouse)s IS NULL OR sii.warehouse = %(warehouse)s)
+        ),
+        last_pp AS (
+            SELECT rate as unit_cost
+            FROM `tabPurchase Receipt Item`
+            WHERE item_code = %(item_code)s
+            AND docstatus = 1
+            AND (%(warehouse)s IS NULL OR warehouse = %(warehouse)s)
+            ORDER BY creation DESC
+            LIMIT 1
+        ),
+        bin_qty AS (
+            SELECT 
+                COALESCE(SUM(actual_qty), 0) as qty_available,
+                COALESCE(SUM(reserved_qty), 0) as reserved_qty,
+                COALESCE(SUM(ordered_qty), 0) as ordered_qty
+            FROM `tabBin`
+            WHERE item_code = %(item_code)s
+            AND (%(warehouse)s IS NULL OR warehouse = %(warehouse)s)
+        )
+        SELECT 
+            p.*,
+            GREATEST(0, p.qty_available - p.on_hold - p.par_with_buffer) as wholesale_qty
+        FROM (
+            SELECT 
+                m.*,
+                m.par_level * %(months_par)s * (1 + %(buffer_percent)s / 100) as par_with_buffer
+            FROM (
+                SELECT 
+                    (SELECT total_qty FROM par) / COALESCE(
+                        %(months_div)s,
+                        GREATEST(PERIOD_DIFF(
+                            EXTRACT(YEAR_MONTH FROM CURDATE()),
+                            EXTRACT(YEAR_MONTH FROM %(lookback_date)s)
+                        ), 1)
+                    ) as par_level,
+                    (SELECT on_hold FROM on_hold) as on_hold,
+                    (SELECT total_amount FROM avg_price) as total_amount,
+                    (SELECT total_qty FROM avg_price) as sold_qty,
+                    COALESCE((SELECT unit_cost FROM last_pp), 0) as cost,
+                    (SELECT qty_available FROM bin_qty) as qty_available,
+                    (SELECT reserved_qty FROM bin_qty) as reserved_qty,
+                    (SELECT ordered_qty FROM bin_qty) as ordered_qty
+            ) m
+        ) p
+    """
+    
+    result = frappe.db.sql(query, {
+        'item_code': item_code,
+        'lookback_date': lookback_date,
+        'warehouse': warehouse,
+        'months_div': months_div or None,
+        'months_par': months_par,
+        'buffer_percent': buffer_percent
+    }, as_dict=True)[0]
+    
+    return {
+        'par_level': result.par_level,
+        'par_with_buffer': result.par_with_buffer,
+        'on_hold': result.on_hold,
+        'avg_sale_price': result.total_amount / result.sold_qty if result.sold_qty > 0 else 0,
+        'cost': result.cost,
+        'qty_available': result.qty_available,
+        'reserved_qty': result.reserved_qty,
+        'ordered_qty': result.ordered_qty,
+        'wholesale_qty': result.wholesale_qty
+    }
+
+
+def calculate_wholesale_qty_sql(item_code, lookback_date, warehouse=None, months_par=6, buffer_percent=10):
+    """
+    Calculate available quantity for wholesale offers for one item entirely
+    in the database (stock, on hold and par fetched and combined in one query)
+    
+    Same formula as calculate_wholesale_qty
+    
+    Args:
+        item_code (str): Item code
+        lookback_date (date|str): Start date for par level (YYYY-MM-DD)
+        warehouse (str): Optional warehouse filter for stock
+        months_par (int): Number of months of par to maintain
+        buffer_percent (float): Additional buffer percentage
+    
+    Returns:
+        float: Quantity available for wholesale (minimum 0)
+    """
+    
+    metrics = get_item_wholesale_metrics(
+        item_code,
+        lookback_date,
+        warehouse,
+        months_par=months_par,
+        buffer_percent=buffer_percent
+    )
+    
+    return metrics['wholesale_qty']
 
 
 def calculate_wholesale_qty(qty_available, on_hold, par_level, months_par=6, buffer_percent=10):
@@ -103,6 +311,127 @@ def calculate_wholesale_qty(qty_available, on_hold, par_level, months_par=6, buf
     return max(0, wholesale_qty)
 
 
+def calculate_wholesale_qty_array(qty_available, on_hold, par_level, months_par=6, buffer_percent=10):
+    """
+    Calculate available quantity for wholesale offers for many items at once
+    Vectorized version of calculate_wholesale_qty
+    
+    Args:
+        qty_available (array-like): Current inventory quantity per item
+        on_hold (array-like): Quantity on hold from SO/Quotations per item
+        par_level (array-like): Average monthly sales per item
+        months_par (int): Number of months of par to maintain
+        buffer_percent (float): Additional buffer percentage
+    
+    Returns:
+        numpy.ndarray: Quantity available for wholesale per item (minimum 0)
+    """
+    
+    import numpy as np
+    
+    qty_available = np.asarray(qty_available, dtype=float)
+    on_hold = np.asarray(on_hold, dtype=float)
+    par_level = np.asarray(par_level, dtype=float)
+    
+    par_with_buffer = (par_level * months_par) * (1 + buffer_percent / 100)
+    
+    return np.maximum(0, qty_available - on_hold - par_with_buffer)
+
+
+def calculate_wholesale_table(item_codes, lookback_date, warehouse=None, months_par=6, buffer_percent=10,
+        months_div=None):
+    """
+    Calculate wholesale metrics for many items at once
+    
+    One grouped query per metric for the whole item list, then
+    wholesale qty is computed for all items with calculate_wholesale_qty_array
+    
+    Args:
+        item_codes (list): Item codes
+        lookback_date (date|str): Start date for sales metrics (YYYY-MM-DD)
+        warehouse (str): Optional warehouse filter for stock and sale price
+        months_par (int): Number of months of par to maintain
+        buffer_percent (float): Additional buffer percentage
+        months_div (int): Optional precomputed number of months in the
+            lookback period
+    
+    Returns:
+        list: One dict per item with item_code, qty_available, on_hold,
+            par_level, avg_sale_price and wholesale_qty
+    """
+    
+    if not item_codes:
+        return []
+    
+    par_by_item = calculate_par_levels_bulk(item_codes, lookback_date, months_div)
+    
+    sii = frappe.qb.DocType("Sales Invoice Item")
+    si = frappe.qb.DocType("Sales Invoice")
+    b = frappe.qb.DocType("Bin")
+    
+    # Stock
+    stock_query = (
+        frappe.qb.from_(b)
+        .select(b.item_code, Sum(b.actual_qty))
+        .where(b.item_code.isin(item_codes))
+        .groupby(b.item_code)
+    )
+    
+    if warehouse:
+        stock_query = stock_query.where(b.warehouse == warehouse)
+    
+    qty_by_item = dict(stock_query.run())
+    
+    # On hold - Sales Orders (outstanding quantity) + open Quotations
+    on_hold_query = f"""
+        SELECT item_code, SUM(qty) as on_hold
+        FROM ({get_on_hold_query("IN %(item_codes)s")}) held
+        GROUP BY item_code
+    """
+    
+    on_hold_by_item = dict(frappe.db.sql(on_hold_query, {'item_codes': tuple(item_codes)}))
+    
+    # Average sale price per unit (before taxes)
+    price_query = (
+        frappe.qb.from_(sii)
+        .join(si).on(sii.parent == si.name)
+        .select(sii.item_code, (Sum(sii.base_amount) / Sum(sii.qty)).as_("avg_sale_price"))
+        .where(sii.item_code.isin(item_codes))
+        .where(si.docstatus == 1)
+        .where(si.posting_date >= lookback_date)
+        .where(si.is_return == 0)
+        .where(sii.qty > 0)
+        .groupby(sii.item_code)
+    )
+    
+    if warehouse:
+        price_query = price_query.where(sii.warehouse == warehouse)
+    
+    price_by_item = dict(price_query.run())
+    
+    # Columns in item_codes order
+    qty_available = [qty_by_item.get(item_code) or 0 for item_code in item_codes]
+    on_hold = [on_hold_by_item.get(item_code) or 0 for item_code in item_codes]
+    par_level = [par_by_item.get(item_code) or 0 for item_code in item_codes]
+    
+    wholesale_qty = calculate_wholesale_qty_array(
+        qty_available, on_hold, par_level, months_par, buffer_percent
+    ).tolist()
+    
+    return [
+        {
+            'item_code': item_code,
+            'qty_available': qty_available[i],
+            'on_hold': on_hold[i],
+            'par_level': par_level[i],
+            'avg_sale_price': price_by_item.get(item_code) or 0,
+            'wholesale_qty': wholesale_qty[i]
+        }
+        for i, item_code in enumerate(item_codes)
+    ]
+
+
+@wholesale_calculation_cache
 def calculate_avg_sale_price(item_code, lookback_date, warehouse=None):
     """
     Calculate average sales price PER UNIT (before taxes) for an item over specified period
@@ -111,42 +440,34 @@ def calculate_avg_sale_price(item_code, lookback_date, warehouse=None):
     
     Args:
         item_code (str): Item code
-        lookback_date (str): Start date for calculation (YYYY-MM-DD)
+        lookback_date (date|str): Start date for calculation (YYYY-MM-DD)
         warehouse (str): Optional warehouse filter
     
     Returns:
         float: Average sale price per unit before taxes
     """
     
+    sii = frappe.qb.DocType("Sales Invoice Item")
+    si = frappe.qb.DocType("Sales Invoice")
+    
+    query = (
+        frappe.qb.from_(sii)
+        .join(si).on(sii.parent == si.name)
+        .select(
+            Coalesce(Sum(sii.base_amount), 0).as_("total_amount"),
+            Coalesce(Sum(sii.qty), 0).as_("total_qty")
+        )
+        .where(sii.item_code == item_code)
+        .where(si.docstatus == 1)
+        .where(si.posting_date >= lookback_date)
+        .where(si.is_return == 0)
+        .where(sii.qty > 0)
+    )
+    
     if warehouse:
-        query = """
-            SELECT 
-                COALESCE(SUM(sii.base_amount), 0) as total_amount,
-                COALESCE(SUM(sii.qty), 0) as total_qty
-            FROM `tabSales Invoice Item` sii
-            JOIN `tabSales Invoice` si ON sii.parent = si.name
-            WHERE sii.item_code = %s
-            AND si.docstatus = 1
-            AND si.posting_date >= %s
-            AND si.is_return = 0
-            AND sii.qty > 0
-            AND sii.warehouse = %s
-        """
-        result = frappe.db.sql(query, (item_code, lookback_date, warehouse), as_dict=True)
-    else:
-        query = """
-            SELECT 
-                COALESCE(SUM(sii.base_amount), 0) as total_amount,
-                COALESCE(SUM(sii.qty), 0) as total_qty
-            FROM `tabSales Invoice Item` sii
-            JOIN `tabSales Invoice` si ON sii.parent = si.name
-            WHERE sii.item_code = %s
-            AND si.docstatus = 1
-            AND si.posting_date >= %s
-            AND si.is_return = 0
-            AND sii.qty > 0
-        """
-        result = frappe.db.sql(query, (item_code, lookback_date), as_dict=True)
+        query = query.where(sii.warehouse == warehouse)
+    
+    result = query.run(as_dict=True)
     
     if result and result[0].total_qty > 0:
         # Calculate per-unit price: total amount / total quantity
@@ -155,11 +476,13 @@ def calculate_avg_sale_price(item_code, lookback_date, warehouse=None):
     return 0
 
 
+@wholesale_calculation_cache
 def get_last_purchase_price(item_code, warehouse=None):
     """
     Get the last purchase price PER UNIT from most recent Purchase Receipt
     Optionally filtered by warehouse
     Uses rate which is the per-unit cost
+    Reads the child table only - submitted rows carry docstatus = 1
     
     Args:
         item_code (str): Item code
@@ -171,24 +494,22 @@ def get_last_purchase_price(item_code, warehouse=None):
     
     if warehouse:
         query = """
-            SELECT pri.rate as unit_cost
-            FROM `tabPurchase Receipt Item` pri
-            JOIN `tabPurchase Receipt` pr ON pri.parent = pr.name
-            WHERE pri.item_code = %s
-            AND pr.docstatus = 1
-            AND pri.warehouse = %s
-            ORDER BY pr.posting_date DESC, pr.creation DESC
+            SELECT rate as unit_cost
+            FROM `tabPurchase Receipt Item`
+            WHERE item_code = %s
+            AND docstatus = 1
+            AND warehouse = %s
+            ORDER BY creation DESC
             LIMIT 1
         """
         result = frappe.db.sql(query, (item_code, warehouse), as_dict=True)
     else:
         query = """
-            SELECT pri.rate as unit_cost
-            FROM `tabPurchase Receipt Item` pri
-            JOIN `tabPurchase Receipt` pr ON pri.parent = pr.name
-            WHERE pri.item_code = %s
-            AND pr.docstatus = 1
-            ORDER BY pr.posting_date DESC, pr.creation DESC
+            SELECT rate as unit_cost
+            FROM `tabPurchase Receipt Item`
+            WHERE item_code = %s
+            AND docstatus = 1
+            ORDER BY creation DESC
             LIMIT 1
         """
         result = frappe.db.sql(query, (item_code,), as_dict=True)
@@ -210,23 +531,31 @@ def get_item_sales_history(item_code, months=12):
     Returns:
         list: Monthly sales data
     """
-    from datetime import datetime, timedelta
-    
-    start_date = (datetime.now() - timedelta(days=months * 30)).strftime('%Y-%m-%d')
     
+    # posting_month is a stored, indexed YYYYMM generated column on Sales
+    # Invoice (see patches/add_sales_invoice_posting_month.py), formatted
+    # back to YYYY-MM for the response
+    # Group per invoice first so invoice_count is a plain COUNT(*) rather
+    # than a COUNT(DISTINCT) over every invoice line
     query = """
         SELECT 
-            DATE_FORMAT(si.posting_date, '%%Y-%%m') as month,
-            SUM(sii.qty) as qty_sold,
-            COUNT(DISTINCT si.name) as invoice_count
-        FROM `tabSales Invoice Item` sii
-        JOIN `tabSales Invoice` si ON sii.parent = si.name
-        WHERE sii.item_code = %s
-        AND si.docstatus = 1
-        AND si.posting_date >= %s
-        AND si.is_return = 0
-        GROUP BY DATE_FORMAT(si.posting_date, '%%Y-%%m')
-        ORDER BY month DESC
-    """
-    
-    return frappe.db.sql(query, (item_code, start_date), as_dict=True)
+            INSERT(posting_month, 5, 0, '-') as month,
+            SUM(qty_sold) as qty_sold,
+            COUNT(*) as invoice_count
+        FROM (
+            SELECT 
+                si.posting_month,
+                SUM(sii.qty) as qty_sold
+            FROM `tabSales Invoice Item` sii
+            JOIN `tabSales Invoice` si ON sii.parent = si.name
+            WHERE sii.item_code = %s
+            AND si.docstatus = 1
+            AND si.posting_date >= DATE_SUB(CURDATE(), INTERVAL %s MONTH)
+            AND si.is_return = 0
+            GROUP BY si.name, si.posting_month
+        ) invoices
+        GROUP BY posting_month
+        ORDER BY posting_month DESC
+    """
+    
+    return frappe.db.sql(query, (item_code, int(months)), as_dict=True)